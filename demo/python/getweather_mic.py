@@ -10,24 +10,110 @@
 #
 
 import argparse
+import asyncio
+import atexit
+import functools
+import hashlib
+import logging
 import os
-import struct
+import queue
+import tempfile
+import time
+from collections import OrderedDict
 from datetime import datetime
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from threading import Lock
 from threading import Thread
 
 import numpy as np
+import orjson
 import pvporcupine
-import pyaudio
+import rtmixer
+import sounddevice as sd
 import soundfile
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from google.api_core import exceptions as google_exceptions
+from google.auth import exceptions as google_auth_exceptions
 from google.cloud import texttospeech
 
-from pydub import AudioSegment
-from pydub.playback import play
+# Capacity of the capture ring buffer in samples. Must be a power of two; 2 ** 16 holds ~4 seconds of 16 kHz audio.
+RING_BUFFER_SIZE = 2 ** 16
 
-class PorcupineDemo(Thread):
+# rtmixer's callback only handles float32 samples in [-1, 1]; they are scaled by this factor to 16-bit PCM.
+INT16_SCALE = 32767
+
+# Input latency requested from PortAudio, in Porcupine frames. Leaves the host API room to buffer audio internally when
+# the stream falls behind for a few frames.
+INPUT_LATENCY_FRAMES = 4
+
+# Initial capacity in samples of the buffer holding recorded audio. The buffer doubles whenever it fills up.
+RECORDING_INITIAL_SIZE = 2 ** 20
+
+# Maximum number of sentences synthesized concurrently while earlier ones are being played.
+TTS_MAX_WORKERS = 4
+
+# Sample rate requested from the text-to-speech service for synthesized LINEAR16 audio.
+TTS_SAMPLE_RATE = 24000
+
+# LINEAR16 responses are returned as WAV files; this is the size of the header preceding the raw samples.
+WAV_HEADER_SIZE = 44
+
+# Synthesized sentences are kept on disk in this directory so repeated utterances skip the text-to-speech request,
+# including across runs.
+TTS_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'porcupine_tts')
+
+# Number of synthesized sentences additionally kept in memory.
+TTS_CACHE_SIZE = 256
+
+# Maximum number of synthesized sentences kept on disk. The least recently used ones are removed beyond this.
+TTS_DISK_CACHE_SIZE = 512
+
+_speech_cache = OrderedDict()
+_speech_cache_lock = Lock()
+
+_tts_client = None
+_tts_voice = None
+_tts_audio_config = None
+_tts_lock = Lock()
+
+# Weather requests share one session so the TCP connection and TLS session are kept alive between detections.
+_http = requests.Session()
+_http.headers.update({'x-rapidapi-host': "dark-sky.p.rapidapi.com"})
+_http.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+# Seconds between background refreshes of the weather forecast.
+WEATHER_REFRESH_INTERVAL = 60
+
+# A cached forecast older than this many seconds is fetched again before being spoken.
+WEATHER_MAX_AGE = 5 * 60
+
+# Tuple of the monotonic time of the fetch and the forecast.
+_cached_weather = None
+
+# Detections and diagnostics are logged through a queue so that writing to the console happens on the listener's thread
+# rather than on the audio loop.
+_log_queue = queue.Queue()
+
+logger = logging.getLogger('porcupine')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+logger.addHandler(QueueHandler(_log_queue))
+
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('[%(asctime)s] %(message)s'))
+
+# Started together with the queue handler so records emitted outside `run()`, e.g. by the warm-up thread, are printed
+# too. Stopping at exit flushes whatever is still queued.
+_log_listener = QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+
+class PorcupineDemo(object):
     """
     Microphone Demo for Porcupine wake word engine. It creates an input audio stream from a microphone, monitors it, and
     upon detecting the specified wake word(s) prints the detection time and wake word on console. It optionally saves
@@ -57,8 +143,6 @@ class PorcupineDemo(Thread):
         :param output_path: If provided recorded audio will be stored in this location at the end of the run.
         """
 
-        super(PorcupineDemo, self).__init__()
-
         self._library_path = library_path
         self._model_path = model_path
         self._keyword_paths = keyword_paths
@@ -67,7 +151,104 @@ class PorcupineDemo(Thread):
 
         self._output_path = output_path
         if self._output_path is not None:
-            self._recorded_frames = []
+            self._recorded_audio = np.empty(RECORDING_INITIAL_SIZE, dtype=np.int16)
+            self._num_recorded_samples = 0
+
+        self._events = None
+        self._background_tasks = list()
+
+        # Set while a response is being spoken so the microphone picking up the speaker does not trigger detections.
+        self._muted = False
+
+        Thread(target=warm_up_tts, daemon=True).start()
+
+    def _record(self, pcm):
+        """
+        Appends a frame to the recorded audio, doubling the buffer when it is full so that appends stay amortized O(1).
+        """
+
+        end = self._num_recorded_samples + len(pcm)
+        if end > len(self._recorded_audio):
+            grown = np.empty(max(2 * len(self._recorded_audio), end), dtype=np.int16)
+            grown[:self._num_recorded_samples] = self._recorded_audio[:self._num_recorded_samples]
+            self._recorded_audio = grown
+
+        self._recorded_audio[self._num_recorded_samples:end] = pcm
+        self._num_recorded_samples = end
+
+    async def _handle_events(self):
+        """
+        Consumes detection events queued by the audio loop and speaks the current weather for each one. Blocking work
+        is done in worker threads so the network and playback latency of a response never stalls audio capture.
+        """
+
+        while True:
+            keyword = await self._events.get()
+
+            # A failure to answer one detection is logged so that later detections are still answered.
+            try:
+                weather = await asyncio.to_thread(current_weather)
+                spoken_weather = extract_spoken_weather(weather)
+                print('\n' + '\n'.join(spoken_weather))
+
+                self._muted = True
+                try:
+                    await text_to_speech(spoken_weather)
+                finally:
+                    self._muted = False
+            except Exception:
+                logger.exception('Failed to respond to %s', keyword)
+
+    @staticmethod
+    def _report_task_failure(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Background task %s failed', task.get_name(), exc_info=task.exception())
+
+    async def _listen(self, porcupine, recorder, ring_buffer, keywords):
+        """
+        Monitors the ring buffer for occurrences of the wake word(s) while weather refreshes and responses to earlier
+        detections run concurrently on the same event loop.
+        """
+
+        self._events = asyncio.Queue()
+
+        # References are kept so the background tasks are not garbage collected while pending.
+        self._background_tasks = [
+            asyncio.create_task(refresh_weather(), name='refresh_weather'),
+            asyncio.create_task(self._handle_events(), name='handle_events')]
+        for task in self._background_tasks:
+            task.add_done_callback(self._report_task_failure)
+
+        frame_duration = porcupine.frame_length / porcupine.sample_rate
+
+        action = recorder.record_ringbuffer(ring_buffer)
+
+        while True:
+            if ring_buffer.read_available < porcupine.frame_length:
+                # rtmixer removes the record action once the ring buffer is full, which stops capture for good.
+                if action not in recorder.actions:
+                    logger.warning('Audio ring buffer overflowed; dropped audio and restarted capture')
+                    action = recorder.record_ringbuffer(ring_buffer)
+
+                await asyncio.sleep(frame_duration / 4)
+                continue
+
+            samples = np.frombuffer(ring_buffer.read(porcupine.frame_length), dtype=np.float32)
+            # Clip first so samples slightly outside [-1, 1] saturate instead of wrapping around to full scale.
+            pcm = (np.clip(samples, -1.0, 1.0) * INT16_SCALE).astype(np.int16)
+
+            if self._output_path is not None:
+                self._record(pcm)
+
+            if self._muted:
+                continue
+
+            # The binding copies the frame into a ctypes array element by element; a list of Python ints built by
+            # tolist() in C converts faster than numpy scalars would.
+            result = porcupine.process(pcm.tolist())
+            if result >= 0:
+                logger.info('Detected %s', keywords[result])
+                self._events.put_nowait(keywords[result])
 
     def run(self):
         """
@@ -80,8 +261,7 @@ class PorcupineDemo(Thread):
             keywords.append(os.path.basename(x).replace('.ppn', '').split('_')[0])
 
         porcupine = None
-        pa = None
-        audio_stream = None
+        recorder = None
         try:
             porcupine = pvporcupine.create(
                 library_path=self._library_path,
@@ -89,38 +269,26 @@ class PorcupineDemo(Thread):
                 keyword_paths=self._keyword_paths,
                 sensitivities=self._sensitivities)
 
-            pa = pyaudio.PyAudio()
+            # The recorder's callback is implemented in C and copies captured samples straight into the ring buffer,
+            # so the audio thread never waits on the GIL. `_listen` consumes the buffer one frame at a time.
+            ring_buffer = rtmixer.RingBuffer(elementsize=np.dtype(np.float32).itemsize, size=RING_BUFFER_SIZE)
+
+            frame_duration = porcupine.frame_length / porcupine.sample_rate
 
-            audio_stream = pa.open(
-                rate=porcupine.sample_rate,
+            recorder = rtmixer.Recorder(
+                device=self._input_device_index,
                 channels=1,
-                format=pyaudio.paInt16,
-                input=True,
-                frames_per_buffer=porcupine.frame_length,
-                input_device_index=self._input_device_index)
+                samplerate=porcupine.sample_rate,
+                blocksize=porcupine.frame_length,
+                latency=INPUT_LATENCY_FRAMES * frame_duration)
+            recorder.start()
 
             print('Listening {')
             for keyword, sensitivity in zip(keywords, self._sensitivities):
                 print('  %s (%.2f)' % (keyword, sensitivity))
             print('}')
 
-            while True:
-                pcm = audio_stream.read(porcupine.frame_length)
-                pcm = struct.unpack_from("h" * porcupine.frame_length, pcm)
-
-                if self._output_path is not None:
-                    self._recorded_frames.append(pcm)
-
-                result = porcupine.process(pcm)
-                if result >= 0:
-                    print('[%s] Detected %s' % (str(datetime.now()), keywords[result]))
-                    
-                    # weather 
-                    weather = get_weather()
-                    spoken_weather = extract_spoken_weather(weather)
-                    print(spoken_weather)
-
-                    text_to_speech(spoken_weather)
+            asyncio.run(self._listen(porcupine, recorder, ring_buffer, keywords))
 
         except KeyboardInterrupt:
             print('Stopping ...')
@@ -128,27 +296,34 @@ class PorcupineDemo(Thread):
             if porcupine is not None:
                 porcupine.delete()
 
-            if audio_stream is not None:
-                audio_stream.close()
+            if recorder is not None:
+                recorder.stop()
+                recorder.close()
 
-            if pa is not None:
-                pa.terminate()
-
-            if self._output_path is not None and len(self._recorded_frames) > 0:
-                recorded_audio = np.concatenate(self._recorded_frames, axis=0).astype(np.int16)
+            if self._output_path is not None and self._num_recorded_samples > 0:
+                # Already int16, and slicing returns a view, so the capture is written without any conversion or copy.
+                recorded_audio = self._recorded_audio[:self._num_recorded_samples]
                 soundfile.write(self._output_path, recorded_audio, samplerate=porcupine.sample_rate, subtype='PCM_16')
 
     @classmethod
     def show_audio_devices(cls):
-        fields = ('index', 'name', 'defaultSampleRate', 'maxInputChannels')
+        fields = ('index', 'name', 'default_samplerate', 'max_input_channels')
+
+        for device in audio_devices():
+            print(', '.join("'%s': '%s'" % (k, str(v)) for k, v in zip(fields, device)))
 
-        pa = pyaudio.PyAudio()
+@functools.lru_cache(maxsize=1)
+def audio_devices():
+    """
+    Enumerates audio devices once per process, since querying PortAudio can be slow on systems with many virtual
+    devices.
 
-        for i in range(pa.get_device_count()):
-            info = pa.get_device_info_by_index(i)
-            print(', '.join("'%s': '%s'" % (k, str(info[k])) for k in fields))
+    :return: Tuple of (index, name, default sample rate, max input channels) for each device.
+    """
 
-        pa.terminate()
+    return tuple(
+        (info['index'], info['name'], info['default_samplerate'], info['max_input_channels'])
+        for info in sd.query_devices())
 
 def get_weather():
 
@@ -158,27 +333,60 @@ def get_weather():
     querystring = {"lang":"en","units":"auto"}
 
     headers = {
-        'x-rapidapi-key': str(os.environ['DARK_SKY_API_KEY']),
-        'x-rapidapi-host': "dark-sky.p.rapidapi.com"
+        'x-rapidapi-key': str(os.environ['DARK_SKY_API_KEY'])
     }
 
-    response = requests.request("GET", url, headers=headers, params=querystring)
+    response = _http.get(url, headers=headers, params=querystring, timeout=3)
+    response.raise_for_status()
+
+    return orjson.loads(response.content)
+
+async def refresh_weather():
+    """
+    Keeps the cached forecast up to date so detections do not wait on the weather API. Runs until cancelled; a failed
+    fetch keeps the previous forecast.
+    """
+
+    global _cached_weather
+
+    while True:
+        try:
+            _cached_weather = (time.monotonic(), await asyncio.to_thread(get_weather))
+        except (requests.RequestException, orjson.JSONDecodeError) as e:
+            logger.warning('Failed to refresh weather: %s', e)
+
+        await asyncio.sleep(WEATHER_REFRESH_INTERVAL)
+
+def current_weather():
+    """
+    Returns the cached forecast, fetching it synchronously if it is missing or older than `WEATHER_MAX_AGE`.
+    """
+
+    global _cached_weather
 
-    return response.json()
+    cached = _cached_weather
+    if cached is None or time.monotonic() - cached[0] > WEATHER_MAX_AGE:
+        cached = (time.monotonic(), get_weather())
+        _cached_weather = cached
 
-def extract_spoken_weather(weather_response):
+    return cached[1]
+
+def extract_spoken_weather(weather_response, num_hours=2):
+    """
+    Extracts key pieces of weather information from a Dark Sky forecast.
+
+    :param weather_response: Parsed Dark Sky forecast.
+    :param num_hours: Number of upcoming hours whose temperatures are reported.
+    :return: List of sentences that can be spoken one after another.
+    """
+
+    hourly = weather_response["hourly"]["data"][:num_hours]
+    hourly_times = [datetime.fromtimestamp(x["time"]).strftime('%I:%M %p') for x in hourly]
+    hourly_temps = [round(x["temperature"], 1) for x in hourly]
+    hourly_feels_temps = [round(x["apparentTemperature"], 1) for x in hourly]
 
-    #extract key pieces of weather information. To be parametrized later.i
-    hourly_weather_0_time = datetime.fromtimestamp(weather_response["hourly"]["data"][0]["time"]).strftime('%I:%M %p')
-    hourly_weather_1_time = datetime.fromtimestamp(weather_response["hourly"]["data"][1]["time"]).strftime('%I:%M %p')
-    #print (hourly_weather_0_time)
-    
     current_summary = weather_response["currently"]["summary"]
-    temp_hour_0 = round(weather_response["hourly"]["data"][0]["temperature"],1)
-    temp_hour_1 = round(weather_response["hourly"]["data"][1]["temperature"],1)
-    feels_temp_hour_0 = round(weather_response["hourly"]["data"][0]["apparentTemperature"],1)
-    feels_temp_hour_1 = round(weather_response["hourly"]["data"][1]["apparentTemperature"],1)
-   
+
     today_high_temp = round(weather_response["daily"]["data"][0]["temperatureHigh"],1)
     today_high_temp_time = datetime.fromtimestamp(weather_response["daily"]["data"][0]["temperatureHighTime"]).strftime('%I:%M %p')
     today_min_temp = round(weather_response["daily"]["data"][0]["temperatureLow"],1)
@@ -188,49 +396,200 @@ def extract_spoken_weather(weather_response):
     next_two_days_summary = weather_response["hourly"]["summary"]
     next_seven_days_summary = weather_response["daily"]["summary"]
 
-    # synthesize the above into a one string that can be spoken
-    spoken_weather = "\n" + \
-            "Temperature at " + hourly_weather_0_time + " is " + str(temp_hour_0) + ". " + \
-            "Feels like: " + str(feels_temp_hour_0) + ".\n" + \
-            "At " + hourly_weather_1_time + " it will be " + str(temp_hour_1) + ". " + \
-            "Feels like: " + str(feels_temp_hour_1) + ".\n" + \
-            "Today's high is: " + str(today_high_temp) + " at " + today_high_temp_time + ".\n" + \
-            "Today's low is: " + str(today_min_temp) + " at " + today_low_temp_time
+    # synthesize the above into sentences that can be spoken one after another
+    spoken_weather = list()
+    for i, (hour_time, temp, feels_temp) in enumerate(zip(hourly_times, hourly_temps, hourly_feels_temps)):
+        if i == 0:
+            spoken_weather.append(f"Temperature at {hour_time} is {temp}.")
+        else:
+            spoken_weather.append(f"At {hour_time} it will be {temp}.")
+        spoken_weather.append(f"Feels like: {feels_temp}.")
+
+    spoken_weather.append(f"Today's high is: {today_high_temp} at {today_high_temp_time}.")
+    spoken_weather.append(f"Today's low is: {today_min_temp} at {today_low_temp_time}.")
 
     return spoken_weather
 
-def text_to_speech(data):
-    # Instantiates a client
-    client = texttospeech.TextToSpeechClient()
-
-    # Set the text input to be synthesized
-    synthesis_input = texttospeech.SynthesisInput(text=data)
-
-    # Build the voice request
-    voice = texttospeech.VoiceSelectionParams(
-        language_code="en-GB", ssml_gender=texttospeech.SsmlVoiceGender.FEMALE
-    )  
-
-    # Select the type of audio file you want returned
-    audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.LINEAR16,
-        speaking_rate=1.1
-    )
-
-    # Perform the text-to-speech request on the text input with the selected
-    # voice parameters and audio file type
-    response = client.synthesize_speech(
-        input=synthesis_input, voice=voice, audio_config=audio_config
-    )
-
-    # The response's audio_content is binary.
-    with open("output.wav", "wb") as out:
-        # Write the response to the output file.
-        out.write(response.audio_content)
-        print('Audio content written to file "output.wav"')
-
-    weather_speech = AudioSegment.from_wav("output.wav")
-    play(weather_speech)
+def synthesize_sentence(client, sentence, voice, audio_config):
+    """
+    Synthesizes a sentence, reusing earlier results for the same text and voice settings from memory or disk.
+
+    :return: Raw 16-bit PCM samples of the spoken sentence, without the WAV header.
+    """
+
+    key = hashlib.sha256(("%s|%s|%d|%d|%s" % (
+        sentence,
+        voice.language_code,
+        voice.ssml_gender,
+        audio_config.sample_rate_hertz,
+        audio_config.speaking_rate)).encode('utf-8')).hexdigest()
+
+    with _speech_cache_lock:
+        if key in _speech_cache:
+            _speech_cache.move_to_end(key)
+            return _speech_cache[key]
+
+    cache_path = os.path.join(TTS_CACHE_DIR, key + '.pcm')
+    try:
+        with open(cache_path, 'rb') as f:
+            pcm = f.read()
+    except FileNotFoundError:
+        pcm = None
+    else:
+        # Refresh the modification time, which orders entries for eviction.
+        try:
+            os.utime(cache_path)
+        except FileNotFoundError:
+            pass
+
+    if pcm is None:
+        # Perform the text-to-speech request on the sentence with the selected
+        # voice parameters and audio file type
+        response = client.synthesize_speech(
+            input=texttospeech.SynthesisInput(text=sentence), voice=voice, audio_config=audio_config
+        )
+        pcm = response.audio_content[WAV_HEADER_SIZE:]
+
+        # Write to a temporary file first so a concurrent reader never sees a partially written entry.
+        os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=TTS_CACHE_DIR, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pcm)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        evict_disk_speech_cache()
+
+    with _speech_cache_lock:
+        _speech_cache[key] = pcm
+        if len(_speech_cache) > TTS_CACHE_SIZE:
+            _speech_cache.popitem(last=False)
+
+    return pcm
+
+def evict_disk_speech_cache():
+    """
+    Removes the least recently used synthesized sentences from disk once there are more than `TTS_DISK_CACHE_SIZE`.
+    """
+
+    entries = list()
+    for x in os.listdir(TTS_CACHE_DIR):
+        if x.endswith('.pcm'):
+            path = os.path.join(TTS_CACHE_DIR, x)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                # Removed concurrently by another eviction.
+                pass
+
+    if len(entries) <= TTS_DISK_CACHE_SIZE:
+        return
+
+    entries.sort()
+    for _, path in entries[:len(entries) - TTS_DISK_CACHE_SIZE]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def get_tts():
+    """
+    Lazily creates the text-to-speech client and request settings shared by all calls. Creating the client sets up
+    gRPC channels and resolves credentials, so it is done once per process rather than once per utterance.
+
+    :return: Tuple of client, voice parameters, and audio config.
+    """
+
+    global _tts_client, _tts_voice, _tts_audio_config
+
+    with _tts_lock:
+        if _tts_client is None:
+            # Build the voice request
+            _tts_voice = texttospeech.VoiceSelectionParams(
+                language_code="en-GB", ssml_gender=texttospeech.SsmlVoiceGender.FEMALE
+            )
+
+            # Select the type of audio file you want returned
+            _tts_audio_config = texttospeech.AudioConfig(
+                audio_encoding=texttospeech.AudioEncoding.LINEAR16,
+                sample_rate_hertz=TTS_SAMPLE_RATE,
+                speaking_rate=1.1
+            )
+
+            # Instantiates a client
+            _tts_client = texttospeech.TextToSpeechClient()
+
+        return _tts_client, _tts_voice, _tts_audio_config
+
+def warm_up_tts():
+    """
+    Sends a throwaway synthesis request so that credential discovery, the TLS handshake, and gRPC channel setup happen
+    at startup rather than on the first detection. The request bypasses the speech cache so that it always reaches the
+    service.
+    """
+
+    try:
+        client, voice, audio_config = get_tts()
+        client.synthesize_speech(
+            input=texttospeech.SynthesisInput(text="Hello."), voice=voice, audio_config=audio_config
+        )
+    except (google_exceptions.GoogleAPICallError, google_auth_exceptions.GoogleAuthError, OSError) as e:
+        logger.warning('Failed to warm up text-to-speech: %s', e)
+
+async def text_to_speech(sentences):
+    client, voice, audio_config = await asyncio.to_thread(get_tts)
+
+    semaphore = asyncio.Semaphore(TTS_MAX_WORKERS)
+
+    async def synthesize(sentence):
+        async with semaphore:
+            return await asyncio.to_thread(synthesize_sentence, client, sentence, voice, audio_config)
+
+    # Sentences are synthesized concurrently and played in order, so playback of the first one starts while the rest
+    # are still being synthesized.
+    synthesis_tasks = [asyncio.create_task(synthesize(x)) for x in sentences]
+
+    # Playback runs on its own thread, which opens, writes, and closes the output stream, so the stream is never touched
+    # from two threads and draining it never blocks the event loop.
+    playback_queue = queue.Queue()
+    playback = asyncio.ensure_future(asyncio.to_thread(play_speech, playback_queue))
+
+    completed = False
+    try:
+        for task in synthesis_tasks:
+            playback_queue.put(await task)
+        completed = True
+    finally:
+        # If a sentence failed or the response was cancelled, stop synthesizing the remaining sentences and collect
+        # their results so no exception is left unretrieved.
+        for task in synthesis_tasks:
+            task.cancel()
+        await asyncio.gather(*synthesis_tasks, return_exceptions=True)
+
+        # On failure, drop sentences that have not started playing yet.
+        if not completed:
+            while not playback_queue.empty():
+                playback_queue.get_nowait()
+        playback_queue.put(None)
+
+        # Wait for the playback thread to close the stream even if this coroutine is being cancelled.
+        await asyncio.shield(playback)
+
+def play_speech(playback_queue):
+    """
+    Plays PCM chunks taken from the queue back to back on one output stream, until a `None` sentinel is received.
+    """
+
+    # One output stream is kept open for the whole response so sentences play back to back without reopening the device.
+    with sd.RawOutputStream(samplerate=TTS_SAMPLE_RATE, channels=1, dtype='int16') as stream:
+        while True:
+            pcm = playback_queue.get()
+            if pcm is None:
+                break
+            stream.write(pcm)
 
 def main():
     parser = argparse.ArgumentParser()